@@ -2,18 +2,35 @@
 An implementation of hierarchical timing wheels.
 """
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    # pyproject.toml makes Cython available to pip's build.  The pure
+    # Python module is compiled as is; if the build fails the package
+    # falls back to importing it uncompiled.
+    ext_modules = cythonize(
+        [Extension("epicycle._impl", ["src/epicycle/_impl.py"],
+                   optional=True)],
+        compiler_directives={"language_level": 3},
+    )
 
 setup(
     name="epicycle",
     packages=find_packages("src"),
     package_dir={"": "src"},
+    ext_modules=ext_modules,
+    python_requires=">=3.8",
     install_requires=[
-        "zope.interface"
+        "attrs",
     ],
     license='MIT',
     extras_require={
         "dev": [
+            "Cython",
             "Hypothesis",
             "pytest",
         ],
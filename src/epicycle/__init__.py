@@ -1,3 +1,4 @@
-from ._impl import ITimerModule, Empty, TimingWheel
+from ._interfaces import ITimerModule, Empty
+from ._impl import HierarchicalTimingWheel, TimingWheel
 
-__all__ = ["ITimerModule", "Empty", "TimingWheel"]
+__all__ = ["ITimerModule", "Empty", "HierarchicalTimingWheel", "TimingWheel"]
@@ -1,186 +1,405 @@
 import attr
-from collections import deque
-from zope.interface import Interface, implementer
+import functools
+import itertools
 
+from ._interfaces import Empty
+
+
+def _is_power_of_two(value):
+    return value > 0 and not value & (value - 1)
 
-class Empty(Exception):
-    """
-    Raised when there are
-    """
 
+# Rebuilding a small action map costs more than it frees.
+_REBUILD_MINIMUM = 256
+
+
+def _forget(actions, request_ids):
+    """
+    Drop the given request IDs from an action map in one pass,
+    rebuilding a large map when most of its entries are going away.
 
-class ITimerModule(Interface):
+    :return: The action map to use from now on.
     """
-    A timing module as described in:
+    if (len(request_ids) >= _REBUILD_MINIMUM
+            and len(request_ids) > len(actions) // 2):
+        forgotten = set(request_ids)
+        return {
+            request_id: location
+            for request_id, location in actions.items()
+            if request_id not in forgotten
+        }
+    for request_id in request_ids:
+        actions.pop(request_id, None)
+    return actions
+
+
+@attr.s(slots=True)
+class TimingWheel(object):
+    """
+    Scheme 4 from:
 
     Hashed and Hierarchical Timing Wheels: Data Structures for the
     Efficient Implementation of a Timer Facility
 
     Varghese & Lauck 1987
     """
+    _max_interval = attr.ib()
+    _mask = attr.ib(init=False, repr=False)
+    _time = attr.ib(default=0)
+    _next_id = attr.ib(init=False, repr=False)
 
-    def add(deadline, f, *args, **kwargs):
-        """
-        From the paper:
-
-        The client calls this routine to start a timer that will
-        expire after "Interval" units of time.  The client supplies a
-        Request_ID which is used to distinguish this timer from other
-        timers that the client has outstanding.  Finally, the client
-        can specify what action must be taken on expiry: for instance,
-        calling a client-specified routine, or setting an event flag.
+    _schedule = attr.ib(default=attr.Factory(list), repr=False)
+    _actions = attr.ib(default=attr.Factory(dict))
+    _occupied = attr.ib(init=False, repr=False)
 
-        :param deadline: The relative delay after which to run the
-            action.
-        :type deadline: :py:cls:`int`.
+    @_max_interval.validator
+    def _check_max_interval(self, attribute, value):
+        if not _is_power_of_two(value):
+            raise ValueError(
+                "max_interval must be a power of two, not {!r}".format(value))
 
-        :param f: The action to run after the interval has elapsed.
-        :type f: :py:cls:`callable`.
+    def __attrs_post_init__(self):
+        self._mask = self._max_interval - 1
+        self._schedule = [{} for _ in range(self._max_interval)]
+        self._occupied = 0
+        self._next_id = itertools.count(1).__next__
 
-        :return: An opaque request ID that can be passed to
-                 :py:meth:`ITimerModule.remove`.
-        """
+    def _make_id(self):
+        return self._next_id()
 
-    def remove(request_id):
-        """
-        From the paper:
+    def add(self, interval, f, *args, **kwargs):
+        request_id = self._make_id()
+        if args or kwargs:
+            action = functools.partial(f, *args, **kwargs)
+        else:
+            action = f
+        offset = (self._time + interval) & self._mask
+        bucket = self._schedule[offset]
+        if not bucket:
+            self._occupied |= 1 << offset
+        bucket[request_id] = action
+        self._actions[request_id] = offset
+        return request_id
 
-        This routine uses its knowledge of the client and Request_ID
-        to locate the timer and stop it.
+    def remove(self, request_id):
+        if request_id in self._actions:
+            offset = self._actions.pop(request_id)
+            bucket = self._schedule[offset]
+            # The action may have already run during the current tick.
+            bucket.pop(request_id, None)
+            if not bucket:
+                self._occupied &= ~(1 << offset)
 
-        :param request_id: An identifier returned by
-            :py:meth:`ITimerModule.add`.
+    def tick(self):
+        schedule = self._schedule
+        mask = self._mask
+        time = self._time
+        self._time = time + 1
+        first = time & mask
+        second = (time + 1) & mask
+        occupied = self._occupied
+        if not (occupied >> first | occupied >> second) & 1:
+            return
+        fired = []
+        error = None
+        try:
+            # This consists of actions added with a time of 0.
+            if occupied >> first & 1:
+                items = list(schedule[first].items())
+                try:
+                    self._run(first, items, fired)
+                except BaseException as e:
+                    # The actions after the one that raised are overdue,
+                    # and their bucket does not come round again for a
+                    # whole revolution, so run them with the second
+                    # bucket.
+                    self._defer(first, second, items)
+                    if not isinstance(e, Exception):
+                        raise
+                    error = e
+            if schedule[second]:
+                try:
+                    self._run(
+                        second, list(schedule[second].items()), fired)
+                except Exception:
+                    if error is None:
+                        raise
+            if error is not None:
+                raise error
+        finally:
+            if fired:
+                self._actions = _forget(self._actions, fired)
+
+    def _run(self, offset, items, fired):
         """
-
-    def tick():
+        Run the given items of a bucket, taking each out of the bucket
+        just before it runs.
         """
-        Let the granularity of the timer be T units.  Then every T
-        units this routine checks whether any outstanding timers have
-        expired; if so, it calls stop, which in turn calls the next
-        routine.
+        bucket = self._schedule[offset]
+        for (request_id, action) in items:
+            # An earlier callback may have removed this action.
+            if request_id in bucket:
+                del bucket[request_id]
+                if not bucket:
+                    self._occupied &= ~(1 << offset)
+                fired.append(request_id)
+                action()
+
+    def _defer(self, source, target, items):
         """
-
-    def when():
+        Move the given items that are still in one bucket into another.
         """
-        Return the absolute time at which the soonest action should
-        run.
+        if source == target:
+            return
+        schedule = self._schedule
+        for (request_id, action) in items:
+            if request_id in schedule[source]:
+                del schedule[source][request_id]
+                if not schedule[target]:
+                    self._occupied |= 1 << target
+                schedule[target][request_id] = action
+                self._actions[request_id] = target
+        if not schedule[source]:
+            self._occupied &= ~(1 << source)
 
-        :return: A number; must be the same time as the ``interval``
-                 argument to :py:meth:`ITimerModule.add`.
-
-        :raises Empty: When there are no pending actions.
-        """
+    def when(self):
+        # Bit i of _occupied is set when bucket i is not empty.  Shift
+        # the bitmap so the current slot is bit 0 and find the lowest
+        # set bit, wrapping around to the start of the wheel if every
+        # later slot is empty.
+        occupied = self._occupied
+        if not occupied:
+            raise Empty()
+        time = self._time
+        current = time & self._mask
+        later = occupied >> current
+        if later:
+            return time + (later & -later).bit_length() - 1
+        return (time + self._max_interval - current
+                + (occupied & -occupied).bit_length() - 1)
 
 
-@attr.s
-class _Cell(object):
-    value = attr.ib()
-    successor = attr.ib(default=None, repr=False)
-    predecessor = attr.ib(default=None, repr=False)
-
-    def add(self, successor):
-        if self.successor is not None:
-            self.successor.predecessor = successor
-        successor.predecessor = self
-        self.successor = successor
-
-    def remove(self):
-        if self.predecessor:
-            self.predecessor.successor = self.successor
-        if self.successor:
-            self.successor.predecessor = self.predecessor
-        self.successor = None
-        self.predecessor = None
-
-
-@attr.s
-class _List(object):
-    head = attr.ib()
-    tail = attr.ib()
-
-    def add_to_front(self, value):
-        cell = _Cell(value)
-        cell.successor = self.head.successor
-        cell.predecessor = self.head
-        self.head.successor.predecessor = cell
-        self.head.successor = cell
-        return cell
-
-    def empty(self):
-        return self.head.successor is self.tail
-
-    def consume(self):
-        cell = self.head.successor
-        while cell is not self.tail:
-            next_cell = cell.successor
-            cell.remove()
-            yield cell.value
-            cell = next_cell
-
-
-def make_list():
-    head = _Cell(None)
-    tail = _Cell(None)
-    head.add(tail)
-    tail.add(head)
-    return _List(head, tail)
-
-
-@implementer(ITimerModule)
-@attr.s
-class TimingWheel(object):
+@attr.s(slots=True)
+class HierarchicalTimingWheel(object):
     """
-    Scheme 4 from:
+    Scheme 7 from:
 
     Hashed and Hierarchical Timing Wheels: Data Structures for the
     Efficient Implementation of a Timer Facility
 
     Varghese & Lauck 1987
+
+    Each wheel in ``sizes`` counts in units of a full revolution of the
+    wheel before it, so the default wheels of 256, 64, 64 and 64 slots
+    cover more than 60 million ticks with 448 buckets.  An action is
+    kept in the finest wheel that can tell its deadline apart from the
+    current time, and is moved into a finer wheel once the time reaches
+    the slot it was waiting in.  The coarsest wheel wraps around like
+    :py:class:`TimingWheel`, which bounds how far ahead an action can
+    be scheduled.
     """
-    _max_interval = attr.ib()
+    _sizes = attr.ib(default=(256, 64, 64, 64), converter=tuple)
+    _shifts = attr.ib(init=False, repr=False)
+    _masks = attr.ib(init=False, repr=False)
     _time = attr.ib(default=0)
-    _last_id = attr.ib(default=0)
+    _next_id = attr.ib(init=False, repr=False)
 
-    _schedule = attr.ib(default=attr.Factory(list), repr=False)
+    _wheels = attr.ib(init=False, repr=False)
     _actions = attr.ib(default=attr.Factory(dict))
+    _occupied = attr.ib(init=False, repr=False)
+
+    @_sizes.validator
+    def _check_sizes(self, attribute, value):
+        if not value or not all(_is_power_of_two(size) for size in value):
+            raise ValueError(
+                "sizes must be powers of two, not {!r}".format(value))
 
     def __attrs_post_init__(self):
-        self._schedule = [make_list() for _ in range(self._max_interval)]
+        shifts = [0]
+        for size in self._sizes[:-1]:
+            shifts.append(shifts[-1] + size.bit_length() - 1)
+        self._shifts = tuple(shifts)
+        self._masks = tuple(size - 1 for size in self._sizes)
+        self._wheels = [[{} for _ in range(size)] for size in self._sizes]
+        self._occupied = [0] * len(self._sizes)
+        self._next_id = itertools.count(1).__next__
 
     def _make_id(self):
-        self._last_id += 1
-        return self._last_id
+        return self._next_id()
+
+    def _locate(self, deadline):
+        """
+        Find the bucket an action due at ``deadline`` belongs in.
+
+        :return: A ``(level, slot)`` pair.
+
+        :raises ValueError: When the deadline is beyond the reach of
+            the coarsest wheel.
+        """
+        time = self._time
+        shifts = self._shifts
+        top = len(shifts) - 1
+        for level in range(top):
+            if deadline >> shifts[level + 1] == time >> shifts[level + 1]:
+                break
+        else:
+            level = top
+            if (deadline >> shifts[top]) - (time >> shifts[top]) \
+                    > self._masks[top]:
+                raise ValueError(
+                    "deadline {!r} is too far past {!r}".format(
+                        deadline, time))
+        return level, (deadline >> shifts[level]) & self._masks[level]
+
+    def _place(self, request_id, deadline, action, level, slot):
+        bucket = self._wheels[level][slot]
+        if not bucket:
+            self._occupied[level] |= 1 << slot
+        bucket[request_id] = (deadline, action)
+        self._actions[request_id] = (level, slot)
+
+    def _take(self, level, slot):
+        """
+        Empty a bucket.
+
+        :return: A list of the bucket's ``(request_id, (deadline,
+            action))`` items.
+        """
+        bucket = self._wheels[level][slot]
+        if not bucket:
+            return []
+        items = list(bucket.items())
+        bucket.clear()
+        self._occupied[level] &= ~(1 << slot)
+        return items
 
     def add(self, interval, f, *args, **kwargs):
+        if args or kwargs:
+            action = functools.partial(f, *args, **kwargs)
+        else:
+            action = f
+        deadline = self._time + interval
+        level, slot = self._locate(deadline)
         request_id = self._make_id()
-        action = (f, args, kwargs)
-        offset = (self._time + interval) % self._max_interval
-        timing_list = self._schedule[offset]
-        cell = timing_list.add_to_front((request_id, action))
-        self._actions[request_id] = cell
+        self._place(request_id, deadline, action, level, slot)
         return request_id
 
     def remove(self, request_id):
         if request_id in self._actions:
-            cell = self._actions.pop(request_id)
-            cell.remove()
+            level, slot = self._actions.pop(request_id)
+            bucket = self._wheels[level][slot]
+            # The action may have already run during the current tick.
+            bucket.pop(request_id, None)
+            if not bucket:
+                self._occupied[level] &= ~(1 << slot)
 
     def tick(self):
-        # This consists of actions added with a time of 0.
-        first = self._time % self._max_interval
-        self._time += 1
-        second = self._time % self._max_interval
-        for timing_list in self._schedule[first], self._schedule[second]:
-            for (request_id, action) in timing_list.consume():
-                (f, args, kwargs) = action
-                f(*args, **kwargs)
-                del self._actions[request_id]
+        mask = self._masks[0]
+        time = self._time + 1
+        self._time = time
+        expired = (time - 1) & mask
+        current = time & mask
+        wheel = self._wheels[0]
+        # This consists of actions added with a time of 0.  Copy them
+        # before cascading, which may refill their slot with actions
+        # for the next revolution of the finest wheel, so that every
+        # callback sees the wheels already cascaded.
+        items = list(wheel[expired].items()) if wheel[expired] else []
+        if not time & mask:
+            self._cascade(time)
+        if not items and not wheel[current]:
+            return
+        fired = []
+        error = None
+        try:
+            try:
+                if items:
+                    self._run(expired, items, fired)
+            except BaseException as e:
+                # The actions after the one that raised are overdue.
+                # Move them to the current slot, which runs next.
+                self._defer(expired, current, items)
+                if not isinstance(e, Exception):
+                    raise
+                error = e
+            if wheel[current]:
+                try:
+                    self._run(
+                        current, list(wheel[current].items()), fired)
+                except Exception:
+                    if error is None:
+                        raise
+            if error is not None:
+                raise error
+        finally:
+            if fired:
+                self._actions = _forget(self._actions, fired)
+
+    def _cascade(self, time):
+        # Coarser wheels go first, because they may move actions into
+        # the current slot of a finer wheel that is also due.
+        shifts = self._shifts
+        for level in range(len(shifts) - 1, 0, -1):
+            shift = shifts[level]
+            if time & ((1 << shift) - 1):
+                continue
+            slot = (time >> shift) & self._masks[level]
+            for (request_id, (deadline, action)) in self._take(level, slot):
+                self._place(
+                    request_id, deadline, action, *self._locate(deadline))
+
+    def _run(self, slot, items, fired):
+        """
+        Run the given items of a bucket in the finest wheel, taking
+        each out of the bucket just before it runs.
+        """
+        bucket = self._wheels[0][slot]
+        for (request_id, (deadline, action)) in items:
+            # An earlier callback may have removed this action.
+            if request_id in bucket:
+                del bucket[request_id]
+                if not bucket:
+                    self._occupied[0] &= ~(1 << slot)
+                fired.append(request_id)
+                action()
+
+    def _defer(self, source, target, items):
+        """
+        Move the given items that are still in one bucket of the finest
+        wheel into another, due at the current time.
+        """
+        if source == target:
+            return
+        bucket = self._wheels[0][source]
+        for (request_id, (deadline, action)) in items:
+            if request_id in bucket:
+                del bucket[request_id]
+                self._place(request_id, self._time, action, 0, target)
+        if not bucket:
+            self._occupied[0] &= ~(1 << source)
 
     def when(self):
-        offset = self._time % self._max_interval
-        for i in range(self._max_interval):
-            scaled = (i + offset) % self._max_interval
-            if not self._schedule[scaled].empty():
-                return self._time + i
+        for level, occupied in enumerate(self._occupied):
+            if occupied:
+                break
         else:
             raise Empty()
+        if level == len(self._sizes) - 1:
+            # The coarsest wheel wraps around, so search from its
+            # current slot as TimingWheel.when does.
+            current = (self._time >> self._shifts[level]) & self._masks[level]
+            later = occupied >> current
+            if later:
+                slot = current + (later & -later).bit_length() - 1
+            else:
+                slot = (occupied & -occupied).bit_length() - 1
+        else:
+            # Only slots after the current one are occupied in the finer
+            # wheels.
+            slot = (occupied & -occupied).bit_length() - 1
+        bucket = self._wheels[level][slot]
+        if level == 0:
+            # Every action in a slot of the finest wheel shares a
+            # deadline.
+            return next(iter(bucket.values()))[0]
+        return min(deadline for (deadline, action) in bucket.values())
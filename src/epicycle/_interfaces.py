@@ -0,0 +1,71 @@
+from typing import Protocol, runtime_checkable
+
+
+class Empty(Exception):
+    """
+    Raised when there are
+    """
+
+
+@runtime_checkable
+class ITimerModule(Protocol):
+    """
+    A timing module as described in:
+
+    Hashed and Hierarchical Timing Wheels: Data Structures for the
+    Efficient Implementation of a Timer Facility
+
+    Varghese & Lauck 1987
+    """
+
+    def add(self, deadline, f, *args, **kwargs):
+        """
+        From the paper:
+
+        The client calls this routine to start a timer that will
+        expire after "Interval" units of time.  The client supplies a
+        Request_ID which is used to distinguish this timer from other
+        timers that the client has outstanding.  Finally, the client
+        can specify what action must be taken on expiry: for instance,
+        calling a client-specified routine, or setting an event flag.
+
+        :param deadline: The relative delay after which to run the
+            action.
+        :type deadline: :py:cls:`int`.
+
+        :param f: The action to run after the interval has elapsed.
+        :type f: :py:cls:`callable`.
+
+        :return: An opaque request ID that can be passed to
+                 :py:meth:`ITimerModule.remove`.
+        """
+
+    def remove(self, request_id):
+        """
+        From the paper:
+
+        This routine uses its knowledge of the client and Request_ID
+        to locate the timer and stop it.
+
+        :param request_id: An identifier returned by
+            :py:meth:`ITimerModule.add`.
+        """
+
+    def tick(self):
+        """
+        Let the granularity of the timer be T units.  Then every T
+        units this routine checks whether any outstanding timers have
+        expired; if so, it calls stop, which in turn calls the next
+        routine.
+        """
+
+    def when(self):
+        """
+        Return the absolute time at which the soonest action should
+        run.
+
+        :return: A number; must be the same time as the ``interval``
+                 argument to :py:meth:`ITimerModule.add`.
+
+        :raises Empty: When there are no pending actions.
+        """
@@ -3,11 +3,11 @@ import heapq
 from hypothesis import stateful, strategies as st
 import pytest
 from pyrsistent import pvector
-from epicycle import Empty, ITimerModule, TimingWheel
-from zope.interface import implementer, verify
+from epicycle import (
+    Empty, HierarchicalTimingWheel, ITimerModule, TimingWheel,
+)
 
 
-@implementer(ITimerModule)
 @attr.s
 class TimerHeap(object):
     """
@@ -61,7 +61,8 @@ class TestAPI(object):
 
     @pytest.fixture(params=[
         TimerHeap,
-        lambda: TimingWheel(128)
+        lambda: TimingWheel(128),
+        HierarchicalTimingWheel,
     ])
     def timer(self, request):
         """
@@ -73,7 +74,7 @@ class TestAPI(object):
         """
         The timer provides py:cls:`ITimerModule`.
         """
-        verify.verifyObject(ITimerModule, timer)
+        assert isinstance(timer, ITimerModule)
 
     def test_add_returns_unique_request_id(self, timer):
         """
@@ -123,6 +124,221 @@ class TestAPI(object):
 
         assert run == [1, 2, 3]
 
+    def test_remove_during_tick(self, timer):
+        """
+        An action can remove another action that is due on the same
+        tick, which then does not run.
+        """
+        run = []
+        request_ids = []
+
+        def cancel(name, other):
+            run.append(name)
+            timer.remove(request_ids[other])
+
+        request_ids.append(timer.add(1, cancel, "first", 1))
+        request_ids.append(timer.add(1, cancel, "second", 0))
+
+        timer.tick()
+
+        assert len(run) == 1
+        with pytest.raises(Empty):
+            timer.when()
+
+    def test_add_during_tick(self, timer):
+        """
+        An action can add another action, which runs once its own
+        interval has elapsed.
+        """
+        run = []
+
+        timer.add(1, lambda: timer.add(1, run.append, 2))
+
+        timer.tick()
+        assert run == []
+        assert timer.when() == 2
+
+        timer.tick()
+        assert run == [2]
+
+    @pytest.mark.parametrize("interval", [0, 1])
+    def test_raise_during_tick(self, timer, interval):
+        """
+        When an action raises, another action due on the same tick is
+        not lost and runs no later than the next tick.
+        """
+        run = []
+
+        timer.add(interval, lambda: 1 // 0)
+        timer.add(interval, run.append, "sibling")
+
+        with pytest.raises(ZeroDivisionError):
+            timer.tick()
+        timer.tick()
+
+        assert run == ["sibling"]
+        with pytest.raises(Empty):
+            timer.when()
+
+    def test_interrupt_during_tick(self, timer):
+        """
+        An action that raises something other than an
+        :py:class:`Exception` stops the tick straight away, and the
+        actions it skipped run on the next tick.
+        """
+        run = []
+
+        def interrupt():
+            raise KeyboardInterrupt()
+
+        timer.add(0, interrupt)
+        timer.add(1, run.append, "skipped")
+
+        with pytest.raises(KeyboardInterrupt):
+            timer.tick()
+        assert run == []
+
+        timer.tick()
+        assert run == ["skipped"]
+
+    def test_first_error_raised(self, timer):
+        """
+        When several actions raise on the same tick, the first error
+        is the one that propagates.
+        """
+        def fail(exception):
+            raise exception
+
+        timer.add(0, fail, ValueError("first"))
+        timer.add(1, fail, RuntimeError("second"))
+
+        with pytest.raises(ValueError):
+            timer.tick()
+
+    def test_tick_arguments(self, timer):
+        """
+        Actions are called with the positional and keyword arguments
+        they were added with, or with none at all.
+        """
+        calls = []
+
+        def record(*args, **kwargs):
+            calls.append((args, kwargs))
+
+        timer.add(1, record)
+        timer.add(1, record, 1, 2, key="value")
+
+        timer.tick()
+
+        assert sorted(calls, key=repr) == [
+            ((), {}),
+            ((1, 2), {"key": "value"}),
+        ]
+
+
+class TestTimingWheel(object):
+    """
+    Tests for :py:class:`TimingWheel`.
+    """
+
+    @pytest.mark.parametrize("max_interval", [0, 3, 100, -128])
+    def test_max_interval_must_be_power_of_two(self, max_interval):
+        """
+        A wheel whose size is not a positive power of two is rejected.
+        """
+        with pytest.raises(ValueError):
+            TimingWheel(max_interval)
+
+
+class TestHierarchicalTimingWheel(object):
+    """
+    Tests for :py:class:`HierarchicalTimingWheel`.
+    """
+
+    @pytest.mark.parametrize("sizes", [(), (256, 60), (3, 64)])
+    def test_sizes_must_be_powers_of_two(self, sizes):
+        """
+        Every wheel's size must be a positive power of two.
+        """
+        with pytest.raises(ValueError):
+            HierarchicalTimingWheel(sizes)
+
+    def test_add_beyond_coarsest_wheel(self):
+        """
+        An action further away than the coarsest wheel can reach is
+        rejected.
+        """
+        timer = HierarchicalTimingWheel((4, 4))
+        timer.add(15, lambda: None)
+        with pytest.raises(ValueError):
+            timer.add(16, lambda: None)
+
+    def test_rejected_add_keeps_request_id(self):
+        """
+        An action that is rejected does not use up a request ID.
+        """
+        timer = HierarchicalTimingWheel((4, 4))
+        with pytest.raises(ValueError):
+            timer.add(16, lambda: None)
+        assert timer.add(1, lambda: None) == 1
+
+    def test_cascade(self):
+        """
+        Actions in coarser wheels run on their deadline.
+        """
+        run = []
+        timer = HierarchicalTimingWheel((4, 2, 4))
+        for deadline in (5, 9, 27):
+            timer.add(deadline, run.append, deadline)
+
+        ran_at = {}
+        for time in range(1, 28):
+            timer.tick()
+            for deadline in run:
+                ran_at.setdefault(deadline, time)
+
+        assert ran_at == {5: 5, 9: 9, 27: 27}
+
+    def test_when_during_cascade(self):
+        """
+        An action that runs on a tick that cascades sees the coarser
+        wheels already cascaded.
+        """
+        whens = []
+        timer = HierarchicalTimingWheel((4, 4))
+        timer.add(5, lambda: None)
+        for _ in range(3):
+            timer.tick()
+
+        def check():
+            timer.add(3, lambda: None)
+            whens.append(timer.when())
+
+        timer.add(0, check)
+        timer.tick()
+
+        assert whens == [5]
+
+    def test_raise_during_cascade(self):
+        """
+        When an action raises on a tick that cascades, the other
+        actions that are due still run and none are left behind.
+        """
+        run = []
+        timer = HierarchicalTimingWheel((4, 4))
+        timer.add(4, run.append, "cascaded")
+        for _ in range(3):
+            timer.tick()
+        timer.add(0, lambda: 1 // 0)
+        timer.add(0, run.append, "sibling")
+
+        with pytest.raises(ZeroDivisionError):
+            timer.tick()
+
+        assert sorted(run) == ["cascaded", "sibling"]
+        with pytest.raises(Empty):
+            timer.when()
+
 
 @attr.s
 class _Action(object):
@@ -250,3 +466,13 @@ class VerifyTimingWheelStateMachine(VerificationStateMachine):
 
 
 VerifyTimingWheel = VerifyTimingWheelStateMachine.TestCase
+
+
+class VerifyHierarchicalTimingWheelStateMachine(VerificationStateMachine):
+    def make_epicycle(self):
+        # Small wheels so that scripts cascade through every level.
+        return HierarchicalTimingWheel((4, 2, 2, 4))
+
+
+VerifyHierarchicalTimingWheel = (
+    VerifyHierarchicalTimingWheelStateMachine.TestCase)